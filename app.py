@@ -1,11 +1,13 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 import plotly.express as px
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
 from datetime import datetime
 import json
-import time
-import ast
+import orjson
 import traceback
 import backoff  # Added for advanced retry logic
 
@@ -21,73 +23,158 @@ def init_supabase() -> Client:
         if not hasattr(st.secrets, 'SUPABASE_KEY'):
             raise ValueError("Missing SUPABASE_KEY in secrets")
             
-        # Create client with validated secrets
+        # Create client with validated secrets; cached, so its pooled
+        # keep-alive connections are reused across pages and reruns
         return create_client(
             supabase_url=st.secrets.SUPABASE_URL,
-            supabase_key=st.secrets.SUPABASE_KEY
+            supabase_key=st.secrets.SUPABASE_KEY,
+            options=ClientOptions(postgrest_client_timeout=60)
         )
     except Exception as e:
         st.error(f"Supabase initialization failed: {str(e)}")
         st.stop()
 
 # Advanced pagination with exponential backoff
-@backoff.on_exception(backoff.expo, Exception, max_tries=5)
-def fetch_batch(table_name, page, batch_size):
+# (no fixed delay between pages; only failed/rate-limited requests back off)
+@backoff.on_exception(backoff.expo, Exception, max_tries=5, jitter=backoff.full_jitter)
+def fetch_batch(table_name, columns, page, batch_size, count=None):
     supabase = init_supabase()
     return supabase.table(table_name)\
-                .select("*")\
+                .select(columns, count=count)\
                 .range(page*batch_size, (page+1)*batch_size-1)\
                 .execute()
 
-def fetch_paginated_data(table_name, batch_size=100):
-    all_data = []
+def fetch_paginated_data(table_name, columns="*", batch_size=100):
+    batches = []
+    fetched = 0
     page = 0
     
     try:
-        # First get total count
-        count = init_supabase().table(table_name)\
-                   .select("count", count='exact')\
-                   .execute().count
+        # First page also carries the exact total (no separate count round trip)
+        response = fetch_batch(table_name, columns, page, batch_size, count='exact')
+        # None when the count header is missing: page until a short/empty page
+        count = response.count
+        total = count if count is not None else "?"
         
-        with st.spinner(f"Loading {table_name} (0/{count})..."):
-            while len(all_data) < count:
-                response = fetch_batch(table_name, page, batch_size)
-                all_data.extend(response.data)
+        with st.spinner(f"Loading {table_name} (0/{total})..."):
+            while response.data:
+                # Convert each page to a columnar Arrow table as it arrives
+                batches.append(pa.Table.from_pylist(response.data))
+                fetched += len(response.data)
                 page += 1
-                time.sleep(0.5)  # Conservative delay
                 
                 # Update progress
-                st.write(f"📦 {table_name}: {len(all_data)}/{count} records")
-                
-        return pd.DataFrame(all_data)
+                st.write(f"📦 {table_name}: {fetched}/{total} records")
+                if (count is not None and fetched >= count) or len(response.data) < batch_size:
+                    break
+                response = fetch_batch(table_name, columns, page, batch_size)
+        
+        if not batches:
+            return pa.table({})
+        # Pages infer their own schemas (e.g. int64 vs double): widen on merge
+        return pa.concat_tables(batches, promote_options="permissive")
     
     except Exception as e:
         st.error(f"Error fetching {table_name}: {str(e)}")
         st.stop()
 
-# Optimized data loader
+# Decode one Y9C `data` payload with orjson (handles double-encoded strings)
+def parse_payload(raw):
+    if isinstance(raw, dict):
+        return raw
+    try:
+        parsed = orjson.loads(raw)
+        if isinstance(parsed, str):
+            parsed = orjson.loads(parsed)
+        return parsed if isinstance(parsed, dict) else {}
+    except (orjson.JSONDecodeError, TypeError):
+        return {}
+
+# Raw Arrow tables, shared across sessions without pickling
+@st.cache_resource(ttl=3600, show_spinner="Fetching regulatory data...")
+def load_raw_tables():
+    st.write("⏳ Fetching MDRM mappings...")
+    # Project only the columns load_data reads
+    mdrm_table = fetch_paginated_data('mdrm_mapping', 'mnemonic,item_code,item_name,description,end_date')
+    st.write("⏳ Fetching Y9C reports...")
+    y9c_table = fetch_paginated_data('y9c_full', 'rssd_id,report_period,data')
+    return mdrm_table, y9c_table
+
+# Optimized data loader (keyed on the reporting window, reuses raw tables)
 @st.cache_data(ttl=3600, show_spinner="Loading regulatory data...")
-def load_data():
+def load_data(report_period_min='2018-01-01'):
     try:
         st.write("🚀 Starting optimized data load...")
+        mdrm_table, y9c_table = load_raw_tables()
         
-        # 1. Load MDRM mappings first with server-side filtering
-        st.write("⏳ Loading active MDRM mappings...")
-        mdrm_df = fetch_paginated_data('mdrm_mapping')
-        mdrm_active = mdrm_df[mdrm_df['end_date'] == '9999-12-31']
+        # 1. Active MDRM mappings (boolean mask built in Arrow, before pandas conversion)
+        is_active = pc.equal(mdrm_table['end_date'], '9999-12-31')
+        mdrm_active = mdrm_table.filter(is_active)\
+                        .select(['mnemonic', 'item_code', 'item_name', 'description'])\
+                        .to_pandas()
+        # One row per MDRM code so relabelling can't fan out
+        mdrm_active['code'] = mdrm_active['mnemonic'].str.lower() + mdrm_active['item_code'].astype(str)
+        mdrm_active = mdrm_active.drop_duplicates(subset='code', keep='last')
         st.write(f"✅ Active mappings: {mdrm_active.shape[0]}")
         
-        # 2. Load Y9C data with server-side filtering
-        st.write("⏳ Loading Y9C reports (last 5 years)...")
-        y9c_df = fetch_paginated_data('y9c_full')
+        # 2. Y9C reports within the reporting window
+        y9c_df = y9c_table.to_pandas()
         
         # 3. Server-side filtering (using client-side fallback)
-        y9c_df = y9c_df[y9c_df['report_period'] >= '2018-01-01']  # 5 year window
+        y9c_df = y9c_df[y9c_df['report_period'] >= report_period_min]
         st.write(f"✅ Filtered Y9C records: {y9c_df.shape[0]}")
         
-        # ... [rest of data processing logic] ...
+        # 4. Flatten the JSON payload into one column per MDRM code
+        parsed = [parse_payload(x) for x in y9c_df['data'].to_numpy()]
+        # Only keys that are active MDRM codes become metrics; identifiers such as
+        # rssd9017 (name) or rssd9999 (date) never get a column
+        metric_codes = sorted(set().union(*parsed) & set(mdrm_active['code']))
+        code_idx = {code: i for i, code in enumerate(metric_codes)}
+
+        # Fill a single 2-D block instead of one array per column; float64 because
+        # totals (in thousands) reach ~4e9, past float32's exact-integer range.
+        # Non-numeric values stay NaN
+        values = np.full((len(parsed), len(metric_codes)), np.nan, dtype=np.float64)
+        for i, payload in enumerate(parsed):
+            for code, val in payload.items():
+                j = code_idx.get(code)
+                if j is None:
+                    continue
+                try:
+                    values[i, j] = val
+                except (TypeError, ValueError):
+                    pass
+        # Raw JSON strings and per-row dicts are dead weight once the block is filled
+        del parsed
+        y9c_df = y9c_df.drop(columns='data')
+        metrics_df = pd.DataFrame(values, columns=metric_codes, copy=False)
 
-        return merged_df, merged_df
+        # 5. Label metric columns with their MDRM item names
+        # (first code wins when several share an item name, keeping labels unique)
+        labels = mdrm_active[mdrm_active['code'].isin(metrics_df.columns)]\
+                    .drop_duplicates(subset='item_name')
+        metrics_df = metrics_df.rename(columns=dict(zip(labels['code'], labels['item_name'])))
+
+        merged_df = pd.concat([
+            y9c_df[['rssd_id', 'report_period']].reset_index(drop=True),
+            metrics_df
+        ], axis=1).rename(columns={'rssd_id': 'RSSD ID', 'report_period': 'Report Date'})
+
+        # Parse dates once and keep an int YYYYMMDD key for cheap filtering
+        merged_df['Report Date'] = pd.to_datetime(merged_df['Report Date'], format='%Y-%m-%d', cache=True)
+        merged_df['date_key'] = (
+            merged_df['Report Date'].dt.year * 10000 +
+            merged_df['Report Date'].dt.month * 100 +
+            merged_df['Report Date'].dt.day
+        ).astype('int32')
+        # Low-cardinality string keys as categoricals: int codes for isin/groupby
+        merged_df['RSSD ID'] = merged_df['RSSD ID'].astype('category')
+        st.write(f"✅ Merged dataset: {merged_df.shape[0]} rows x {merged_df.shape[1]} columns")
+
+        # Metric descriptions indexed by item name for O(1) tooltip lookups
+        metric_help = labels.set_index('item_name')['description'].fillna('')
+
+        return metric_help, merged_df
 
     except Exception as e:
         st.error(f"Critical error: {str(e)}")
@@ -112,6 +199,10 @@ def format_metric(value, metric_name):
     except:
         return "N/A"
 
+# Render an int YYYYMMDD key as YYYY-MM-DD
+def format_date_key(key):
+    return f"{key // 10000:04d}-{key // 100 % 100:02d}-{key % 100:02d}"
+
 # Main app
 def main():
     st.set_page_config(
@@ -124,12 +215,11 @@ def main():
     st.caption("Dynamic reporting powered by Supabase data")
 
     # Load data
-    raw_df, analysis_df = load_data()
+    metric_help, analysis_df = load_data()
 
-    # Date handling
+    # Date handling (int YYYYMMDD keys precomputed in load_data)
     if not analysis_df.empty:
-        dates = analysis_df['Report Date'].dt.date.unique()
-        date_options = sorted(dates, reverse=True)
+        date_options = sorted(analysis_df['date_key'].unique(), reverse=True)
     else:
         date_options = []
 
@@ -140,17 +230,21 @@ def main():
         selected_dates = st.multiselect(
             "Reporting Period",
             options=date_options,
-            default=date_options[:1] if date_options else []
+            default=date_options[:1] if date_options else [],
+            format_func=format_date_key
         )
 
+        # Appearance order (not the sorted categories) so the default stays the
+        # first institutions in the data
+        institution_options = list(pd.unique(analysis_df['RSSD ID'])) if not analysis_df.empty else []
         institutions = st.multiselect(
             "Select Institutions",
-            options=analysis_df['RSSD ID'].unique() if not analysis_df.empty else [],
-            default=analysis_df['RSSD ID'].unique()[:3] if not analysis_df.empty else []
+            options=institution_options,
+            default=institution_options[:3]
         )
 
         available_metrics = [col for col in analysis_df.columns 
-                           if col not in ['RSSD ID', 'Report Date', 'composite_key']]
+                           if col not in ['RSSD ID', 'Report Date', 'date_key', 'composite_key']]
         selected_metrics = st.multiselect(
             "Key Metrics",
             options=available_metrics,
@@ -159,7 +253,7 @@ def main():
 
     # Filter data
     filtered_df = analysis_df[
-        (analysis_df['Report Date'].dt.date.isin(selected_dates)) &
+        (analysis_df['date_key'].isin(selected_dates)) &
         (analysis_df['RSSD ID'].isin(institutions))
     ] if not analysis_df.empty else pd.DataFrame()
 
@@ -169,15 +263,15 @@ def main():
         cols = st.columns(len(selected_metrics))
         latest_date = filtered_df['Report Date'].max()
         latest_data = filtered_df[filtered_df['Report Date'] == latest_date]
+        means = latest_data[selected_metrics].mean(numeric_only=True)
         
         for idx, metric in enumerate(selected_metrics):
             with cols[idx]:
-                value = latest_data[metric].mean()
+                value = means.get(metric)
                 st.metric(
                     label=metric,
                     value=format_metric(value, metric),
-                    help=raw_df[raw_df['item_name'] == metric]['description'].iloc[0] 
-                         if not raw_df.empty else ""
+                    help=metric_help.get(metric, "")
                 )
     else:
         st.warning("No data available for selected filters")
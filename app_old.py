@@ -1,9 +1,14 @@
 # app.py
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
-import json
+import orjson
 import os
+import time
+import uuid
+from pathlib import Path
 from urllib.parse import quote
 
 # ─── CONFIGURATION ───
@@ -23,53 +28,71 @@ HEADERS = {
     "Content-Type": "application/json"
 }
 
+CACHE_DIR = Path("cache")
+CACHE_MAX_AGE = 3600  # seconds a parquet snapshot stays fresh
+
+# One pooled keep-alive session per process, reused across reruns
+@st.cache_resource
+def get_session():
+    session = requests.Session()
+    session.headers.update({**HEADERS, "Accept-Encoding": "gzip"})
+    retries = Retry(total=3, backoff_factor=0.3, status_forcelist=(429, 502, 503, 504), raise_on_status=False)
+    session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=retries))
+    return session
+
+SESSION = get_session()
+
 # ─── HELPER FUNCTIONS ───
-def extract_field(data, field):
-    try:
-        return float(data.get(field, None))
-    except Exception:
-        return None
+ASSET_BINS = [float("-inf"), 100_000_000, 250_000_000, 500_000_000, 750_000_000, float("inf")]
+ASSET_LABELS = ["<100 billion", "100-250 billion", "250-500 billion", "500-750 billion", ">=750 billion"]
 
-def safe_parse_json(x):
-    try:
-        if isinstance(x, str):
-            return json.loads(json.loads(x)) if x.strip().startswith('"{"') else json.loads(x)
-        elif isinstance(x, dict):
-            return x
-        return {}
-    except Exception:
-        return {}
-
-def infer_total_assets(x):
-    return extract_field(x, "bhck2170") or extract_field(x, "bhck0337") or extract_field(x, "bhck0020")
-
-def asset_bucket(val):
-    if val is None or val == 0:
-        return None
-    if val >= 750_000_000:
-        return ">=750 billion"
-    elif val >= 500_000_000:
-        return "500-750 billion"
-    elif val >= 250_000_000:
-        return "250-500 billion"
-    elif val >= 100_000_000:
-        return "100-250 billion"
-    else:
-        return "<100 billion"
+def asset_bucket(total_assets):
+    # Zero/missing assets get no bucket; bins are closed on the left (>=)
+    return pd.cut(total_assets.where(total_assets != 0), bins=ASSET_BINS, labels=ASSET_LABELS, right=False)
+
+def bucket_bounds(bucket):
+    # [min, max) total-assets range for a bucket label; None means unbounded
+    if bucket is None:
+        return None, None
+    i = ASSET_LABELS.index(bucket)
+    lo, hi = ASSET_BINS[i], ASSET_BINS[i + 1]
+    return (None if lo == float("-inf") else int(lo)), (None if hi == float("inf") else int(hi))
 
 @st.cache_data(ttl=600)
-def fetch_all_data():
+def fetch_all_data(asset_min=None, asset_max=None):
+    # Parquet snapshot on disk survives process restarts, unlike st.cache_data
+    cache_path = CACHE_DIR / f"y9c_{asset_min}_{asset_max}.parquet"
+    if cache_path.exists() and time.time() - cache_path.stat().st_mtime < CACHE_MAX_AGE:
+        try:
+            df = pd.read_parquet(cache_path)
+            # Parquet hands string[pyarrow] back as string[python]: restore the Arrow dtype
+            df["rssd_id"] = df["rssd_id"].astype("string[pyarrow]")
+            return df
+        except Exception:
+            cache_path.unlink(missing_ok=True)  # unreadable snapshot: refetch below
+
     rows = []
     page_size = 2000
     offset = 0
 
+    # Push the asset-size range down to PostgREST so excluded banks never leave the DB
+    range_filter = ""
+    if asset_min is not None:
+        range_filter += f"&total_assets=gte.{asset_min}"
+    if asset_max is not None:
+        range_filter += f"&total_assets=lt.{asset_max}"
+
     while True:
-        url = f"{SUPABASE_URL}/rest/v1/y9c_full?select=rssd_id,data&offset={offset}&limit={page_size}"
-        r = requests.get(url, headers=HEADERS)
+        # y9c_flat (sql/y9c_flat.sql) extracts the JSON fields server-side
+        url = f"{SUPABASE_URL}/rest/v1/y9c_flat?select=rssd_id,bank_name,report_period,total_assets{range_filter}&offset={offset}&limit={page_size}"
+        r = SESSION.get(url)
         if r.status_code != 200:
-            break
+            # Stop without caching a partial result
+            st.error(f"❌ Supabase error: {r.status_code} – {r.text}")
+            st.stop()
 
-        page = r.json()
+        # orjson's C parser straight from the raw bytes, skipping requests' decode step
+        page = orjson.loads(r.content)
         if not page:
             break
 
@@ -82,19 +105,31 @@ def fetch_all_data():
     if not rows:
         return pd.DataFrame()
 
-    df = pd.json_normalize(rows)
-    df["rssd_id"] = df["rssd_id"].astype(str)
-    df["parsed"] = df["data"].apply(safe_parse_json)
-    df["bank_name"] = df["parsed"].apply(lambda x: x.get("rssd9017", "Unknown"))
-    df["report_period"] = df["parsed"].apply(lambda x: x.get("rssd9999"))
-    df["total_assets"] = df["parsed"].apply(lambda x: infer_total_assets(x) if isinstance(x, dict) else None)
-    df["asset_bucket"] = df["total_assets"].apply(asset_bucket)
+    df = pd.DataFrame.from_records(rows, columns=["rssd_id", "bank_name", "report_period", "total_assets"])
+    # Arrow-backed strings: contiguous UTF-8, and the search below runs as an Arrow kernel
+    df["rssd_id"] = df["rssd_id"].astype(str).astype("string[pyarrow]")
+    # Repeated across periods: categorical keeps one copy per name
+    df["bank_name"] = df["bank_name"].fillna("Unknown").astype("category")
+    # A few dozen distinct periods: int codes make the period filter a code compare
+    # (missing periods stay NaN rather than becoming a "None" category)
+    df["report_period"] = df["report_period"].astype("string").astype("category")
+    df["asset_bucket"] = asset_bucket(pd.to_numeric(df["total_assets"], errors="coerce"))
+
+    # Write to a unique temp file and rename, so readers never see a partial snapshot
+    tmp_path = cache_path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+    try:
+        CACHE_DIR.mkdir(exist_ok=True)
+        df.to_parquet(tmp_path, compression="zstd")
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        tmp_path.unlink(missing_ok=True)  # read-only filesystem: fall back to the in-memory cache only
     return df
 
-@st.cache_data(ttl=600)
+@st.cache_data(ttl=3600)
 def get_all_report_periods():
-    url = f"{SUPABASE_URL}/rest/v1/y9c_full?select=data&limit=9999"
-    r = requests.get(url, headers=HEADERS)
+    # Postgres dedupes and sorts (sql/distinct_report_periods.sql)
+    url = f"{SUPABASE_URL}/rest/v1/rpc/distinct_report_periods"
+    r = SESSION.post(url)
 
     if not r.ok:
         st.error(f"❌ Supabase error: {r.status_code} – {r.text}")
@@ -102,22 +137,44 @@ def get_all_report_periods():
 
     try:
         data = r.json()
-        parsed = [safe_parse_json(row["data"]) for row in data if isinstance(row, dict) and "data" in row]
-        return sorted({str(x.get("rssd9999")) for x in parsed if x.get("rssd9999")}, reverse=True)
+        return [str(row["report_period"]) for row in data]
     except Exception as e:
         st.error(f"❌ Failed to parse periods: {e}")
         return []
 
+@st.cache_data(ttl=600, max_entries=64)
+def build_display(period, bank_query, bucket):
+    # Filtered, formatted summary table; memoized on the widget values so
+    # reruns that don't touch the filters skip the filter/format work
+    # (bounded: every distinct search string is its own entry)
+    filtered_df = fetch_all_data(*bucket_bounds(bucket))
+
+    if period:
+        filtered_df = filtered_df[filtered_df["report_period"] == period]
+
+    if bank_query:
+        q = bank_query.lower().strip()
+        filtered_df = filtered_df[
+            filtered_df["bank_name"].str.lower().str.contains(q) |
+            filtered_df["rssd_id"].str.contains(q)
+        ]
+
+    if bucket:
+        filtered_df = filtered_df[filtered_df["asset_bucket"] == bucket]
+
+    total_assets = pd.to_numeric(filtered_df["total_assets"], errors="coerce").dropna()
+    display_df = filtered_df.loc[total_assets.index, ["rssd_id", "bank_name", "report_period"]]
+    return display_df.assign(**{"Total Assets ($)": total_assets.map("${:,.0f}".format)})[
+        ["rssd_id", "bank_name", "Total Assets ($)", "report_period"]
+    ]
+
 # ─── MAIN ───
 if st.button("🔄 Reload Data"):
     st.cache_data.clear()
+    for cached in CACHE_DIR.glob("y9c_*.parquet"):
+        cached.unlink(missing_ok=True)
     st.rerun()
 
-full_df = fetch_all_data()
-if full_df.empty:
-    st.warning("⚠️ No data returned.")
-    st.stop()
-
 # ─── FILTERS ───
 st.subheader("🔎 Optional Filters")
 
@@ -126,33 +183,17 @@ selected_period = st.selectbox("Select Reporting Period", [None] + raw_periods)
 
 bank_query = st.text_input("Search Bank (Legal Name or RSSD ID)")
 
-asset_buckets = sorted(full_df["asset_bucket"].dropna().unique())
-selected_bucket = st.selectbox("Select Asset Bucket", [None] + asset_buckets)
-
-# ─── APPLY FILTERS ───
-filtered_df = full_df.copy()
-
-if selected_period:
-    filtered_df = filtered_df[filtered_df["report_period"] == selected_period]
+selected_bucket = st.selectbox("Select Asset Bucket", [None] + ASSET_LABELS)
 
-if bank_query:
-    q = bank_query.lower().strip()
-    filtered_df = filtered_df[
-        filtered_df["bank_name"].str.lower().str.contains(q) |
-        filtered_df["rssd_id"].str.contains(q)
-    ]
-
-if selected_bucket:
-    filtered_df = filtered_df[filtered_df["asset_bucket"] == selected_bucket]
+full_df = fetch_all_data(*bucket_bounds(selected_bucket))
+if full_df.empty:
+    st.warning("⚠️ No data returned.")
+    st.stop()
 
 # ─── CLEANED DISPLAY ───
 st.subheader("🏦 Bank Summary")
 
-filtered_df["total_assets"] = pd.to_numeric(filtered_df["total_assets"], errors="coerce")
-display_df = filtered_df.dropna(subset=["total_assets"]).copy()
-display_df["Total Assets ($)"] = display_df["total_assets"].apply(lambda x: f"${x:,.0f}")
-
 st.dataframe(
-    display_df[["rssd_id", "bank_name", "Total Assets ($)", "report_period"]],
+    build_display(selected_period, bank_query, selected_bucket),
     use_container_width=True
 )
@@ -1,92 +1,175 @@
 # chatbot.py
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
-from supabase import create_client, ClientOptions
-import openai
-import json
+import plotly.express as px
+import httpx
+from openai import OpenAI
+import orjson
+import asyncio
+import hashlib
+import math
+import os
+import sqlite3
 import time
+import uuid
+from contextlib import closing
+from pathlib import Path
 
 # Configuration
 ESSENTIAL_COLS = ['bhck2170', 'bhck2948', 'bhck3210']
+METRIC_NAMES = {'bhck2170': 'assets', 'bhck2948': 'liabilities', 'bhck3210': 'equity'}
 CACHE_TTL = 86400  # 24 hours cache
 PAGE_SIZE = 200    # Reduced for free tier safety
 MAX_PAGES = 5      # Max 1000 records
+MAX_CONCURRENCY = 3  # Concurrent page requests (free tier safety)
+MAX_RETRIES = 3      # Attempts per page when rate limited (429)
+MAX_RETRY_WAIT = 10  # Cap on a single Retry-After sleep, in seconds
+DISK_CACHE_PATH = Path("cache/chatbot_metrics.parquet")  # On-disk snapshot of the data load
+AI_CACHE_PATH = Path("cache/ai_cache.sqlite")  # On-disk cache of AI answers
+AI_CACHE_TTL = 86400  # 24 hours
+AI_MODEL = "gpt-4o"
 
-def init_supabase():
-    """Initialize Supabase client with error handling"""
+async def fetch_page(client, sem, page):
+    """Fetch one page of y9c_metrics, bounded by the shared semaphore"""
+    params = {
+        'select': ','.join(['report_period', *ESSENTIAL_COLS]),
+        # Total order over the (distinct) rows so offset pages never overlap
+        'order': ','.join(['report_period.desc', *(f'{c}.desc' for c in ESSENTIAL_COLS)]),
+        'offset': page * PAGE_SIZE,
+        'limit': PAGE_SIZE
+    }
+    async with sem:
+        for attempt in range(MAX_RETRIES):
+            r = await client.get('/y9c_metrics', params=params)
+            if r.status_code != 429 or attempt == MAX_RETRIES - 1:
+                break
+            # Rate limited: wait as long as the server asks (capped), then retry;
+            # HTTP-date or malformed values fall back to 1s
+            try:
+                wait = float(r.headers.get('retry-after', '1'))
+            except ValueError:
+                wait = 1
+            await asyncio.sleep(min(max(wait, 0), MAX_RETRY_WAIT))
+        r.raise_for_status()
+        return r.json()
+
+async def fetch_all_pages():
+    """Count rows once, then request every page concurrently"""
+    headers = {
+        "apikey": st.secrets.SUPABASE_KEY,
+        "Authorization": f"Bearer {st.secrets.SUPABASE_KEY}"
+    }
+    async with httpx.AsyncClient(base_url=f"{st.secrets.SUPABASE_URL}/rest/v1",
+                                 headers=headers, http2=True, timeout=30) as client:
+        r = await client.head('/y9c_metrics', params={'select': 'report_period'},
+                              headers={'Prefer': 'count=exact'})
+        r.raise_for_status()
+        total = r.headers.get('content-range', '*/0').split('/')[-1]
+        n_pages = min(MAX_PAGES, math.ceil(int(total) / PAGE_SIZE)) if total.isdigit() else MAX_PAGES
+
+        sem = asyncio.Semaphore(MAX_CONCURRENCY)
+        return await asyncio.gather(*(fetch_page(client, sem, p) for p in range(n_pages)))
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner="📥 Loading financial data...")
+def fetch_financial_data():
+    """Fetch and shape all pages once per CACHE_TTL; raises so failures aren't cached"""
+    # Parquet snapshot on disk survives restarts/redeploys, unlike st.cache_data
+    if DISK_CACHE_PATH.exists() and time.time() - DISK_CACHE_PATH.stat().st_mtime < CACHE_TTL:
+        try:
+            return pd.read_parquet(DISK_CACHE_PATH)
+        except Exception:
+            DISK_CACHE_PATH.unlink(missing_ok=True)  # unreadable snapshot: refetch below
+
+    # y9c_metrics (sql/y9c_metrics.sql) returns typed columns: no JSON parsing here
+    rows = [row for page_rows in asyncio.run(fetch_all_pages()) for row in page_rows]
+    df = pd.DataFrame.from_records(rows, columns=['report_period', *ESSENTIAL_COLS])
+    if df.empty:
+        raise ValueError("no rows returned")
+
+    df = df.rename(columns=METRIC_NAMES)
+    # Reporting dates are day-granular: second resolution is plenty
+    df['report_period'] = pd.to_datetime(df['report_period'], format='%Y-%m-%d', cache=True)\
+                            .astype('datetime64[s]')
+    df = df[['report_period', *METRIC_NAMES.values()]]
+
+    # Write to a unique temp file and rename, so readers never see a partial snapshot
+    tmp_path = DISK_CACHE_PATH.with_suffix(f'.{uuid.uuid4().hex}.tmp')
     try:
-        return create_client(
-            st.secrets.SUPABASE_URL,
-            st.secrets.SUPABASE_KEY,
-            options=ClientOptions(
-                postgrest_client_timeout=30,
-                schema='public'
-            )
-        )
-    except Exception as e:
-        st.error(f"🔌 Connection Error: {str(e)}")
-        st.stop()
+        DISK_CACHE_PATH.parent.mkdir(exist_ok=True)
+        df.to_parquet(tmp_path, compression='zstd')
+        os.replace(tmp_path, DISK_CACHE_PATH)
+    except OSError:
+        tmp_path.unlink(missing_ok=True)  # read-only filesystem: keep the in-memory cache only
+    return df
 
 def load_financial_data():
     """Simplified data loader with better error handling"""
     try:
-        supabase = init_supabase()
-        processed_data = []
-        
-        st.info("🔍 Connecting to database...")
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-
-        for page in range(MAX_PAGES):
-            try:
-                status_text.text(f"📥 Loading page {page+1}/{MAX_PAGES}...")
-                
-                # Simple query without range for free tier compatibility
-                response = supabase.table('y9c_full') \
-                            .select('data,report_period') \
-                            .order('report_period', desc=True) \
-                            .limit(PAGE_SIZE) \
-                            .execute()
-
-                if not response.data:
-                    break
-
-                # Process data
-                for row in response.data:
-                    try:
-                        clean_data = row['data'].replace('""', '"')
-                        parsed = json.loads(clean_data)
-                        processed_data.append({
-                            'report_period': pd.to_datetime(row['report_period']),
-                            'assets': float(parsed.get('bhck2170', 0)),
-                            'liabilities': float(parsed.get('bhck2948', 0)),
-                            'equity': float(parsed.get('bhck3210', 0))
-                        })
-                    except Exception as e:
-                        continue
-                
-                progress = (page + 1) / MAX_PAGES
-                progress_bar.progress(progress)
-                time.sleep(1)  # Rate limiting
-
-            except Exception as e:
-                st.error(f"⚠️ Error loading page {page+1}: {str(e)}")
-                break
-
-        progress_bar.empty()
-        status_text.empty()
-        
-        if not processed_data:
-            st.error("❌ No data loaded - check database connection and data format")
-            return pd.DataFrame()
-        
-        return pd.DataFrame(processed_data).drop_duplicates()
-    
+        return fetch_financial_data()
     except Exception as e:
-        st.error(f"🚨 Critical Error: {str(e)}")
+        st.error(f"❌ No data loaded - check database connection and data format ({str(e)})")
         return pd.DataFrame()
 
+def read_cached_answer(key):
+    """Return a fresh cached AI answer from disk, or None"""
+    try:
+        AI_CACHE_PATH.parent.mkdir(exist_ok=True)
+        with closing(sqlite3.connect(AI_CACHE_PATH)) as conn, conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS ai_insights (key TEXT PRIMARY KEY, answer TEXT, created REAL)")
+            hit = conn.execute("SELECT answer FROM ai_insights WHERE key = ? AND created > ?",
+                               (key, time.time() - AI_CACHE_TTL)).fetchone()
+    except (OSError, sqlite3.Error):
+        return None  # read-only filesystem: no disk cache
+    return hit[0] if hit else None
+
+def write_cached_answer(key, answer):
+    """Store an AI answer on disk for AI_CACHE_TTL"""
+    try:
+        AI_CACHE_PATH.parent.mkdir(exist_ok=True)
+        with closing(sqlite3.connect(AI_CACHE_PATH)) as conn, conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS ai_insights (key TEXT PRIMARY KEY, answer TEXT, created REAL)")
+            conn.execute("INSERT OR REPLACE INTO ai_insights VALUES (?, ?, ?)", (key, answer, time.time()))
+    except (OSError, sqlite3.Error):
+        pass  # read-only filesystem: keep the session memo only
+
+@st.cache_resource
+def get_openai():
+    """One OpenAI client per process, with a pooled keep-alive HTTP/2 connection"""
+    return OpenAI(http_client=httpx.Client(
+        http2=True,
+        limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+        timeout=60
+    ))
+
+def generate_ai_insight(query, latest):
+    """Render an answer about the latest metrics, streaming tokens on a cache miss"""
+    # Case/whitespace variants of the same question share one cache entry
+    normalized = ' '.join(query.lower().split())
+    key = hashlib.sha256(orjson.dumps([AI_MODEL, normalized, latest], option=orjson.OPT_SORT_KEYS)).hexdigest()
+    # Per-session memo spares reruns the disk lookup; disk is shared across sessions
+    answers = st.session_state.setdefault('ai_answers', {})
+    answer = answers.get(key) or read_cached_answer(key)
+    if answer is not None:
+        st.write(answer)
+    else:
+        stream = get_openai().chat.completions.create(
+            model=AI_MODEL,
+            messages=[{
+                "role": "user",
+                "content": f"""Analyze these banking metrics:
+                - Latest Assets: ${latest['assets']:,.0f}
+                - Latest Liabilities: ${latest['liabilities']:,.0f}
+                - Latest Equity: ${latest['equity']:,.0f}
+                Question: {query}"""
+            }],
+            stream=True
+        )
+        # First tokens show up immediately instead of after the full completion
+        answer = st.write_stream(stream)
+        write_cached_answer(key, answer)
+    answers[key] = answer
+    return answer
+
 def main():
     st.set_page_config(page_title="Banking Analytics", layout="centered")
     st.title("🏦 Banking Analytics Dashboard")
@@ -106,7 +189,7 @@ def main():
                 st.error("❌ No data available")
                 st.write("Troubleshooting steps:")
                 st.write("1. Check Supabase connection secrets")
-                st.write("2. Verify 'y9c_full' table exists")
+                st.write("2. Verify the 'y9c_metrics' view exists (sql/y9c_metrics.sql)")
                 st.write("3. Ensure 'data' column contains valid JSON")
                 return
         
@@ -115,26 +198,16 @@ def main():
         selected_metric = st.selectbox("Choose metric", ['assets', 'liabilities', 'equity'])
         
         if not df.empty:
-            fig, ax = plt.subplots()
-            df.set_index('report_period')[selected_metric].plot(ax=ax)
-            st.pyplot(fig)
+            # Plotly renders client-side; no server-side rasterisation per rerun
+            fig = px.line(df.sort_values('report_period'), x='report_period', y=selected_metric)
+            st.plotly_chart(fig, use_container_width=True)
             
             with st.expander("Advanced Analysis"):
                 query = st.text_input("Ask a question about the data:")
                 if query:
                     try:
-                        response = openai.chat.completions.create(
-                            model="gpt-4o",
-                            messages=[{
-                                "role": "user",
-                                "content": f"""Analyze these banking metrics:
-                                - Latest Assets: ${df['assets'].iloc[0]:,.0f}
-                                - Latest Liabilities: ${df['liabilities'].iloc[0]:,.0f}
-                                - Latest Equity: ${df['equity'].iloc[0]:,.0f}
-                                Question: {query}"""
-                            }]
-                        )
-                        st.write(response.choices[0].message.content)
+                        latest = {m: float(df[m].iloc[0]) for m in METRIC_NAMES.values()}
+                        generate_ai_insight(query, latest)
                     except Exception as e:
                         st.error(f"🤖 AI Error: {str(e)}")
 
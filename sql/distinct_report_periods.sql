@@ -0,0 +1,12 @@
+-- distinct_report_periods: one row per reporting period, newest first.
+-- Called via /rest/v1/rpc/distinct_report_periods so the period picker
+-- downloads O(periods) rows instead of every bank's report_period.
+-- Reads the materialized y9c_flat (sql/y9c_flat.sql), so no JSON is decoded per call.
+create or replace function distinct_report_periods()
+returns table(report_period text)
+language sql stable as $$
+    select distinct report_period
+    from y9c_flat
+    where report_period is not null
+    order by 1 desc
+$$;
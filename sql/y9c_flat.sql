@@ -0,0 +1,41 @@
+-- y9c_flat: typed projection of y9c_full for the dashboard.
+-- Pulls the few fields the UI shows out of the `data` payload server-side,
+-- so clients never download or parse the full JSON blob.
+-- Decodes with the row-safe helpers in sql/y9c_parse.sql: a bad payload or
+-- non-numeric code gives NULL fields instead of failing the whole SELECT.
+-- Materialized so app_old.py's pages and the distinct_report_periods RPC
+-- read stored, indexed rows instead of re-decoding all of y9c_full; run
+--   refresh materialized view y9c_flat;
+-- after each ingest.
+
+-- Earlier versions shipped this as a plain view
+do $$
+begin
+    if exists (select 1 from pg_views
+               where schemaname = current_schema() and viewname = 'y9c_flat') then
+        drop view y9c_flat;
+    end if;
+end
+$$;
+drop materialized view if exists y9c_flat;
+
+create materialized view y9c_flat as
+select
+    rssd_id,
+    payload->>'rssd9017' as bank_name,
+    payload->>'rssd9999' as report_period,
+    -- first non-zero of the total-assets codes, matching the old client logic
+    coalesce(
+        nullif(y9c_float8(payload->>'bhck2170'), 0),
+        nullif(y9c_float8(payload->>'bhck0337'), 0),
+        y9c_float8(payload->>'bhck0020')
+    ) as total_assets
+from (
+    select rssd_id, y9c_payload(data::text) as payload
+    from y9c_full
+) as decoded;
+
+-- distinct_report_periods and the period filter
+create index y9c_flat_report_period_idx on y9c_flat (report_period);
+-- the asset-bucket range filter (total_assets=gte/lt)
+create index y9c_flat_total_assets_idx on y9c_flat (total_assets);
@@ -0,0 +1,45 @@
+-- y9c_metrics: the balance-sheet codes chatbot.py charts, typed server-side.
+-- Decodes `data` with y9c_payload (sql/y9c_parse.sql) and casts each code,
+-- treating missing codes as 0 like the old client-side parser did.
+-- Rows with an unparseable payload or a non-numeric metric are skipped.
+-- Duplicate rows are collapsed here rather than in pandas.
+-- Materialized so the chatbot's count and page requests read stored rows
+-- instead of re-decoding all of y9c_full; run
+--   refresh materialized view y9c_metrics;
+-- after each ingest.
+
+-- Earlier versions shipped this as a plain view
+do $$
+begin
+    if exists (select 1 from pg_views
+               where schemaname = current_schema() and viewname = 'y9c_metrics') then
+        drop view y9c_metrics;
+    end if;
+end
+$$;
+drop materialized view if exists y9c_metrics;
+
+create materialized view y9c_metrics as
+select distinct
+    report_period,
+    bhck2170,
+    bhck2948,
+    bhck3210
+from (
+    select
+        report_period,
+        y9c_float8(coalesce(payload->>'bhck2170', '0')) as bhck2170,
+        y9c_float8(coalesce(payload->>'bhck2948', '0')) as bhck2948,
+        y9c_float8(coalesce(payload->>'bhck3210', '0')) as bhck3210
+    from (
+        select report_period, y9c_payload(data::text) as payload
+        from y9c_full
+    ) as decoded
+    where payload is not null
+) as typed
+where bhck2170 is not null
+  and bhck2948 is not null
+  and bhck3210 is not null;
+
+-- chatbot.py pages ordered by report_period desc
+create index y9c_metrics_report_period_idx on y9c_metrics (report_period desc);
@@ -0,0 +1,46 @@
+-- y9c_parse: row-safe decoding helpers shared by the y9c_* views.
+-- Run this script before the views that use it.
+-- A bad row yields NULL instead of failing the whole SELECT, like the old
+-- client-side parsers that skipped unparseable payloads one at a time.
+-- The views that use these are materialized, so decoding runs once per
+-- REFRESH rather than on every API request.
+
+-- Decode a `data` payload to a jsonb object; NULL if it isn't one.
+-- Accepts three stored formats:
+--   * plain JSON:          {"bhck2170": "123"}
+--   * double-encoded JSON: "{\"bhck2170\": \"123\"}"  (one level unwrapped)
+--   * doubled quotes:      {""bhck2170"": ""123""}   (CSV-style escaping)
+-- The doubled-quote repair only runs when the text isn't valid JSON as-is,
+-- so legitimate empty strings ("") in valid payloads are left alone.
+create or replace function y9c_payload(raw text)
+returns jsonb
+language plpgsql immutable as $$
+declare
+    j jsonb;
+begin
+    begin
+        j := raw::jsonb;
+    exception when others then
+        j := replace(raw, '""', '"')::jsonb;
+    end;
+    if jsonb_typeof(j) = 'string' then
+        j := (j #>> '{}')::jsonb;
+    end if;
+    return case when jsonb_typeof(j) = 'object' then j end;
+exception when others then
+    return null;
+end
+$$;
+
+-- Cast a text value to float8; NULL if it isn't numeric.
+-- A regex guard instead of an exception block: plain SQL, so the planner
+-- inlines it and no subtransaction is opened per call. Digit and exponent
+-- lengths are bounded so the cast itself can't overflow.
+create or replace function y9c_float8(val text)
+returns float8
+language sql immutable as $$
+    select case
+        when val ~ '^\s*[-+]?(\d{1,30}(\.\d*)?|\.\d+)([eE][-+]?\d{1,2})?\s*$'
+        then val::float8
+    end
+$$;
@@ -2,10 +2,35 @@
 import pandas as pd
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import streamlit as st
-from datetime import datetime
+import pickle
+import time
+import uuid
+from datetime import date
+from pathlib import Path
 
+CACHE_PATH = Path("cache/mdrm_mapping.pkl")
+CACHE_TTL = 86400  # seconds
+
+# Pooled keep-alive session with gzip, reused across pages and reloads
+SESSION = requests.Session()
+SESSION.headers.update({"Accept-Encoding": "gzip"})
+SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=10,
+                                      max_retries=Retry(total=3, backoff_factor=0.2)))
+
+# Loaded once per process and shared across reruns/sessions (treat as read-only)
+@st.cache_resource(ttl=86400, show_spinner="Loading MDRM mapping...")
 def load_mnemonic_mapping():
+    # On-disk snapshot survives process restarts
+    if CACHE_PATH.exists() and time.time() - CACHE_PATH.stat().st_mtime < CACHE_TTL:
+        try:
+            with CACHE_PATH.open("rb") as f:
+                return pickle.load(f)
+        except Exception:
+            CACHE_PATH.unlink(missing_ok=True)  # unreadable snapshot: refetch below
+
     SUPABASE_URL = os.environ.get("SUPABASE_URL") or st.secrets.get("SUPABASE_URL")
     SUPABASE_KEY = os.environ.get("SUPABASE_KEY") or st.secrets.get("SUPABASE_KEY")
 
@@ -17,14 +42,22 @@ def load_mnemonic_mapping():
         "Authorization": f"Bearer {SUPABASE_KEY}"
     }
 
-    # Fetch up to 10,000 rows in pages of 2,000
+    # Only active FR Y-9C items, newest first; filtering happens in Postgres
+    params = {
+        "select": "mnemonic,item_code,item_name,start_date",
+        "reporting_form": "ilike.*FR Y-9C*",
+        "or": f"(end_date.is.null,end_date.gte.{date.today().isoformat()})",
+        "order": "start_date.desc.nullslast",
+    }
+
+    # Fetch in pages of 2,000
     rows = []
     page_size = 2000
     offset = 0
 
     while True:
-        url = f"{SUPABASE_URL}/rest/v1/mdrm_mapping?select=*&offset={offset}&limit={page_size}"
-        response = requests.get(url, headers=headers)
+        url = f"{SUPABASE_URL}/rest/v1/mdrm_mapping"
+        response = SESSION.get(url, headers=headers, params={**params, "offset": offset, "limit": page_size})
         if response.status_code != 200:
             raise Exception(f"❌ Failed to load MDRM data: {response.text}")
 
@@ -40,17 +73,25 @@ def load_mnemonic_mapping():
     df = pd.DataFrame(rows)
 
     if df.empty:
-        raise ValueError("⚠️ MDRM table in Supabase is empty.")
-
-    df.columns = df.columns.str.strip().str.lower().str.replace(" ", "_")
-    df["start_date"] = pd.to_datetime(df["start_date"], errors="coerce")
-    df["end_date"] = pd.to_datetime(df["end_date"], errors="coerce")
-
-    df = df[df["reporting_form"].str.contains("FR Y-9C", na=False)]
-    df = df[df["end_date"].isna() | (df["end_date"] >= datetime.today())]
+        raise ValueError("⚠️ No active FR Y-9C items in the Supabase MDRM table.")
 
+    # Rows arrive newest start_date first, so keep="first" keeps the latest definition
     df["key"] = df["mnemonic"].str.upper() + df["item_code"].astype(str)
-    df = df.sort_values(by="start_date", ascending=False)
     df = df.drop_duplicates(subset="key", keep="first")
 
-    return {row["key"]: row["item_name"].strip() for _, row in df.iterrows()}
+    # zip over the two column arrays instead of boxing every row with iterrows
+    keys = df["key"].to_numpy()
+    names = df["item_name"].str.strip().to_numpy()
+    mapping = dict(zip(keys, names))
+
+    # Write to a unique temp file and rename, so readers never see a partial snapshot
+    tmp_path = CACHE_PATH.with_suffix(f".{uuid.uuid4().hex}.tmp")
+    try:
+        CACHE_PATH.parent.mkdir(exist_ok=True)
+        with tmp_path.open("wb") as f:
+            pickle.dump(mapping, f, protocol=5)
+        os.replace(tmp_path, CACHE_PATH)
+    except OSError:
+        tmp_path.unlink(missing_ok=True)  # read-only filesystem: rely on the in-process cache
+
+    return mapping